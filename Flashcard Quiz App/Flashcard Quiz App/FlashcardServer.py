@@ -5,6 +5,22 @@ import threading
 import json
 import random
 import time
+import csv
+import hashlib
+import os
+import argparse
+import hmac
+import base64
+import struct
+import zlib
+import heapq
+import contextlib
+import cProfile
+import pstats
+import io
+import sys
+import collections
+import math
 
 
 HOST = '0.0.0.0'
@@ -14,6 +30,27 @@ PORT = 5555
 MIN_PLAYERS = 2
 TOTAL_QUESTIONS = 5
 ANSWER_TIME_LIMIT = 30
+TRANSITION_DELAY = 2  # Pause before the first/next question
+
+# WebSocket gateway settings (same game, second listener)
+WEBSOCKET_PORT = 5556
+WEBSOCKET_COMPRESSION = True  # Offer permessage-deflate to clients
+WEBSOCKET_COMPRESSION_MIN_SIZE = 128  # Smaller messages are sent uncompressed
+WEBSOCKET_MAX_MESSAGE_SIZE = 65536
+
+# Admin settings
+# Admin messages (e.g. IMPORT) are disabled unless this token is set
+ADMIN_TOKEN = os.environ.get('FLASHCARD_ADMIN_TOKEN')
+
+# Deck import settings
+IMPORT_BATCH_SIZE = 1000
+IMPORT_PROGRESS_INTERVAL = 100000
+MAX_FIELD_LENGTH = 500
+
+# Profiling settings (see the PROFILE admin message)
+PROFILE_MAX_DURATION = 300
+PROFILE_DEFAULT_SAMPLE_EVERY = 10  # cProfile every Nth message
+PROFILE_DEFAULT_INTERVAL = 0.005  # Seconds between stack samples
 
 FLASHCARD_POOL = [
     {
@@ -113,19 +150,426 @@ FLASHCARD_POOL = [
     }
 ]
 
+
+# ============================================================================
+# FLASHCARD DECK & INDEXES
+# ============================================================================
+
+REQUIRED_FIELDS = ('question', 'answer', 'category')
+
+# Indexes kept in step with FLASHCARD_POOL (updated card by card, never rebuilt)
+# - category_index: {category: [flashcard, ...]}
+# - flashcard_hashes: content hashes of every card in the pool, for dedupe
+# Only a 16-byte digest is kept per card, so memory stays low with millions
+# of cards; answers are normalized when they are matched instead.
+category_index = {}
+flashcard_hashes = set()
+pool_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Normalize text for comparison (case-insensitive, strip whitespace)"""
+    return text.strip().lower()
+
+
+def flashcard_hash(card):
+    """
+    Compute a content hash for a flashcard
+    
+    CONCEPT: Content Hashing
+    - Cards with the same question, answer and category are duplicates,
+      even if they differ in case or surrounding whitespace
+    - A small fixed-size digest lets us remember millions of cards cheaply
+    
+    Args:
+        card: Flashcard dictionary
+    
+    Returns:
+        16-byte digest identifying the card's content
+    """
+    key = '\x1f'.join(normalize_text(card[field]) for field in REQUIRED_FIELDS)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+def validate_flashcard(record):
+    """
+    Validate a raw deck record and return a clean flashcard
+    
+    Numbers (e.g. {"answer": 206} in a JSONL deck) are accepted and
+    stored as text; booleans and non-finite numbers are not.
+    
+    Args:
+        record: Dictionary read from a deck file
+    
+    Returns:
+        Flashcard dictionary with question, answer and category
+    
+    Raises:
+        ValueError: If the record is malformed or a field is missing/too long
+    """
+    if not isinstance(record, dict):
+        raise ValueError('Record must be a JSON object')
+    
+    card = {}
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                and math.isfinite(value)):
+            value = str(value)
+        
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'Field must be text or a number: {field}')
+        if not value or not value.strip():
+            raise ValueError(f'Missing or empty field: {field}')
+        
+        value = value.strip()
+        if len(value) > MAX_FIELD_LENGTH:
+            raise ValueError(f'Field too long: {field}')
+        card[field] = value
+    
+    return card
+
+
+def add_flashcards(cards):
+    """
+    Add flashcards to the pool, skipping duplicates
+    
+    CONCEPT: Incremental Indexing
+    - Each new card is appended to FLASHCARD_POOL and slotted into the
+      category index and hash set straight away
+    - Category names are interned, so every card in a category shares
+      one string instead of keeping its own copy
+    - pool_lock is held for one batch only, so games keep running
+    
+    Args:
+        cards: List of validated flashcard dictionaries
+    
+    Returns:
+        (added, duplicates) counts
+    """
+    added = 0
+    duplicates = 0
+    
+    with pool_lock:
+        for card in cards:
+            card_hash = flashcard_hash(card)
+            if card_hash in flashcard_hashes:
+                duplicates += 1
+                continue
+            
+            card['category'] = sys.intern(card['category'])
+            FLASHCARD_POOL.append(card)
+            category_index.setdefault(card['category'], []).append(card)
+            flashcard_hashes.add(card_hash)
+            added += 1
+    
+    return added, duplicates
+
+
+def index_builtin_flashcards():
+    """Index the built-in FLASHCARD_POOL (run once when the module loads)"""
+    global FLASHCARD_POOL
+    
+    builtin_cards = FLASHCARD_POOL
+    FLASHCARD_POOL = []
+    add_flashcards(builtin_cards)
+
+
+def category_counts():
+    """Return {category: number of flashcards} from the category index"""
+    with pool_lock:
+        return {category: len(cards) for category, cards in category_index.items()}
+
+
+def iter_deck_records(path):
+    """
+    Yield raw records from a CSV or JSONL deck file, one at a time
+    
+    CONCEPT: Streaming
+    - The file is read record by record, never loaded whole
+    - Memory use stays flat no matter how large the deck is
+    
+    CSV decks need a header row with question, answer and category
+    columns. JSONL decks hold one JSON object per line.
+    
+    Args:
+        path: Path to a .csv, .jsonl or .ndjson file
+    
+    Yields:
+        (line_number, record) tuples - record is None if the line isn't JSON
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.csv', '.jsonl', '.ndjson'):
+        raise ValueError(f'Unsupported deck format: {path}')
+    
+    with open(path, newline='', encoding='utf-8-sig') as deck_file:
+        if extension == '.csv':
+            reader = csv.DictReader(deck_file)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(deck_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_number, None
+
+
+def import_deck(path, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Stream a deck file into FLASHCARD_POOL
+    
+    CONCEPT: Bounded-Memory Bulk Import
+    - Records are validated one at a time as they are read
+    - Valid cards are added in batches of batch_size, taking pool_lock
+      once per batch so a live game is never blocked for long
+    - Duplicates (by content hash) are counted and skipped
+    - Progress and the final rate are reported in records per second
+    
+    Args:
+        path: Path to a CSV or JSONL deck
+        batch_size: Number of cards to add per pool_lock acquisition
+    
+    Returns:
+        Dictionary of import statistics
+    
+    Raises:
+        OSError, ValueError, csv.Error: If the file can't be read
+    """
+    stats = {'path': path, 'read': 0, 'added': 0, 'duplicates': 0, 'invalid': 0}
+    batch = []
+    start_time = time.monotonic()
+    
+    print(f"📥 Importing deck {path}...")
+    
+    for line_number, record in iter_deck_records(path):
+        stats['read'] += 1
+        
+        try:
+            batch.append(validate_flashcard(record))
+        except ValueError as e:
+            stats['invalid'] += 1
+            if stats['invalid'] <= 10:
+                print(f"⚠ {path}:{line_number}: {e}")
+        
+        if len(batch) >= batch_size:
+            added, duplicates = add_flashcards(batch)
+            stats['added'] += added
+            stats['duplicates'] += duplicates
+            batch = []
+        
+        if stats['read'] % IMPORT_PROGRESS_INTERVAL == 0:
+            elapsed = time.monotonic() - start_time
+            print(f"📥 {path}: {stats['read']:,} records ({stats['read'] / elapsed:,.0f}/s)")
+    
+    if batch:
+        added, duplicates = add_flashcards(batch)
+        stats['added'] += added
+        stats['duplicates'] += duplicates
+    
+    elapsed = time.monotonic() - start_time
+    stats['seconds'] = round(elapsed, 3)
+    stats['rate'] = round(stats['read'] / elapsed) if elapsed > 0 else stats['read']
+    
+    print(f"✓ Imported {path}: {stats['added']:,} added, "
+          f"{stats['duplicates']:,} duplicates, {stats['invalid']:,} invalid "
+          f"({stats['rate']:,} records/s)")
+    return stats
+
+
+index_builtin_flashcards()
+
+
+# ============================================================================
+# CLOCK & RANDOMNESS
+# ============================================================================
+
+class RealClock:
+    """
+    Wall-clock time for the live server
+    
+    All game timing goes through a clock object, so a VirtualClock can be
+    swapped in to run games without actually waiting.
+    """
+    
+    def now(self):
+        return time.monotonic()
+    
+    def sleep(self, seconds):
+        time.sleep(seconds)
+    
+    def call_later(self, delay, callback):
+        """Run callback after delay seconds; returns an object with cancel()"""
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class VirtualTimer:
+    """A callback scheduled on a VirtualClock"""
+    
+    __slots__ = ('callback', 'cancelled')
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    """
+    Simulated time for deterministic games
+    
+    CONCEPT: Virtual Time
+    - sleep() just moves the clock forward, it never blocks
+    - Timers wait in a heap and only fire when run() advances the clock
+      past their deadline
+    - Everything runs on one thread, in a fixed order, so the same
+      script and seed always produce the same game
+    
+    Sleeps are atomic: nothing else runs during one. A timer that comes
+    due mid-sleep fires only after the sleeping handler returns (at the
+    clock's new time), whereas on a live server the timer thread could
+    fire during the pause.
+    """
+    
+    def __init__(self):
+        self._now = 0.0
+        self._timers = []  # Heap of (deadline, sequence, VirtualTimer)
+        self._sequence = 0  # Tie-breaker: timers due together fire in order
+    
+    def now(self):
+        return self._now
+    
+    def sleep(self, seconds):
+        self._now += seconds
+    
+    def call_later(self, delay, callback):
+        timer = VirtualTimer(callback)
+        self._sequence += 1
+        heapq.heappush(self._timers, (self._now + delay, self._sequence, timer))
+        return timer
+    
+    def run(self, until=None):
+        """
+        Fire timers in deadline order, advancing the clock as they fire
+        
+        Args:
+            until: Stop at this time (None = run until no timers are left)
+        """
+        while self._timers and (until is None or self._timers[0][0] <= until):
+            deadline, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            self._now = max(self._now, deadline)
+            timer.callback()
+        
+        if until is not None:
+            self._now = max(self._now, until)
+
+
+# The engine reads these at call time; run_simulation() swaps them out
+clock = RealClock()
+rng = random.Random()
+
 # List of connected players: [{'name': str, 'socket': socket, 'score': int, 'ready': bool}]
 players = []
-players_lock = threading.Lock()
+players_lock = threading.RLock()  # Re-entrant: broadcasts run while it is held
 
 # Game state
 game_started = False
-game_lock = threading.Lock()
+game_lock = threading.RLock()  # Re-entrant: end_game() can run while it is held
 current_question_index = 0
 questions = []
 question_timer = None
 
 
-def send_message(client_socket, message_dict):
+# ============================================================================
+# MESSAGE ENCODING
+# ============================================================================
+
+def build_websocket_frame(payload, opcode=0x1, compressed=False):
+    """
+    Wrap a payload in a single unmasked (server-to-client) WebSocket frame
+    
+    Args:
+        payload: Frame payload bytes
+        opcode: 0x1 text, 0x8 close, 0x9 ping, 0xA pong
+        compressed: Set RSV1 to mark a permessage-deflate payload
+    """
+    first_byte = 0x80 | opcode  # FIN + opcode
+    if compressed:
+        first_byte |= 0x40
+    
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first_byte, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', first_byte, 126, length)
+    else:
+        header = struct.pack('!BBQ', first_byte, 127, length)
+    
+    return header + payload
+
+
+def deflate_payload(payload):
+    """
+    Compress a payload for permessage-deflate (RFC 7692)
+    
+    A fresh compressor is used for every message (server_no_context_takeover),
+    so the same compressed frame can be sent to any number of clients.
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4]  # Drop the 00 00 ff ff sync marker, per the RFC
+
+
+class EncodedMessage:
+    """
+    A message serialized to JSON once and framed for each transport on demand
+    
+    CONCEPT: Encode Once, Send Many
+    - json.dumps() runs once per message, not once per player
+    - The TCP line and WebSocket frames are built the first time a client
+      of that kind needs them, then reused for every other client
+    """
+    
+    __slots__ = ('message_type', 'payload', '_tcp_line', '_websocket_frame',
+                 '_deflated_frame')
+    
+    def __init__(self, message_dict):
+        self.message_type = message_dict.get('type', 'UNKNOWN')
+        self.payload = json.dumps(message_dict).encode('utf-8')
+        self._tcp_line = None
+        self._websocket_frame = None
+        self._deflated_frame = None
+    
+    def tcp_line(self):
+        """Newline-delimited JSON for raw TCP clients"""
+        if self._tcp_line is None:
+            self._tcp_line = self.payload + b'\n'
+        return self._tcp_line
+    
+    def websocket_frame(self, deflate=False):
+        """Text frame for WebSocket clients (compressed if negotiated)"""
+        if deflate and len(self.payload) >= WEBSOCKET_COMPRESSION_MIN_SIZE:
+            if self._deflated_frame is None:
+                self._deflated_frame = build_websocket_frame(
+                    deflate_payload(self.payload), compressed=True
+                )
+            return self._deflated_frame
+        
+        if self._websocket_frame is None:
+            self._websocket_frame = build_websocket_frame(self.payload)
+        return self._websocket_frame
+
+
+def send_message(client_socket, message):
     """
     Send a JSON message to a client
     
@@ -133,16 +577,21 @@ def send_message(client_socket, message_dict):
     - Converts Python dict to JSON string
     - Encodes as UTF-8 bytes for network transmission
     - Adds newline delimiter so client knows message is complete
+      (WebSocket clients get a text frame instead)
     
     Args:
-        client_socket: The socket to send to
-        message_dict: Dictionary to send as JSON
+        client_socket: The socket (or WebSocketClient) to send to
+        message: Dictionary to send as JSON, or an already EncodedMessage
     """
     try:
-        json_string = json.dumps(message_dict)
-        message_bytes = (json_string + '\n').encode('utf-8')
-        client_socket.sendall(message_bytes)
-        print(f"→ Sent: {message_dict.get('type', 'UNKNOWN')} to client")
+        if not isinstance(message, EncodedMessage):
+            message = EncodedMessage(message)
+        
+        if isinstance(client_socket, WebSocketClient):
+            client_socket.send_frame(message.websocket_frame(client_socket.deflate))
+        else:
+            client_socket.sendall(message.tcp_line())
+        print(f"→ Sent: {message.message_type} to client")
     except Exception as e:
         print(f"Error sending message: {e}")
 
@@ -152,21 +601,30 @@ def broadcast(message_dict, exclude_socket=None):
     Send a message to all connected players
     
     CONCEPT: Broadcasting
-    - Iterate through all connected clients
-    - Send same message to each one
+    - Encode the message once
+    - Send same bytes to each connected client
     - Optionally exclude one client (e.g., the sender)
     
     Args:
         message_dict: Message to send
         exclude_socket: Optional socket to skip
     """
+    session = profiler
+    if session is not None:
+        started = time.perf_counter()
+    
+    encoded = EncodedMessage(message_dict)
+    
     with players_lock:
         for player in players[:]:
             if player['socket'] != exclude_socket:
                 try:
-                    send_message(player['socket'], message_dict)
+                    send_message(player['socket'], encoded)
                 except Exception as e:
                     print(f"Error broadcasting to {player['name']}: {e}")
+    
+    if session is not None:
+        session.record('fanout', time.perf_counter() - started)
 
 
 def get_player_by_socket(client_socket):
@@ -208,10 +666,14 @@ def broadcast_scores():
         # Sort by score (highest first)
         scores.sort(key=lambda x: x['score'], reverse=True)
         
-        message = {
+        message = EncodedMessage({
             'type': 'SCORE_UPDATE',
             'scores': scores
-        }
+        })
+        
+        session = profiler
+        if session is not None:
+            started = time.perf_counter()
         
         # Broadcast while still holding lock to prevent race conditions
         for player in players[:]:
@@ -219,6 +681,9 @@ def broadcast_scores():
                 send_message(player['socket'], message)
             except Exception as e:
                 print(f"Error sending scores to {player['name']}: {e}")
+        
+        if session is not None:
+            session.record('fanout', time.perf_counter() - started)
 
 
 # ============================================================================
@@ -243,7 +708,8 @@ def initialize_game():
             question_timer = None
         
         # Select random questions
-        questions = random.sample(FLASHCARD_POOL, min(TOTAL_QUESTIONS, len(FLASHCARD_POOL)))
+        with pool_lock:
+            questions = rng.sample(FLASHCARD_POOL, min(TOTAL_QUESTIONS, len(FLASHCARD_POOL)))
         current_question_index = 0
         game_started = True
     
@@ -273,6 +739,12 @@ def send_next_question():
         if not game_started:
             return
         
+        # Stop the previous question's timer (e.g. when NEXT skips ahead),
+        # otherwise it would still fire and skip this question too
+        if question_timer:
+            question_timer.cancel()
+            question_timer = None
+        
         if current_question_index < len(questions):
             question_data = questions[current_question_index]
             
@@ -295,9 +767,7 @@ def send_next_question():
             
             current_question_index += 1
             
-            question_timer = threading.Timer(ANSWER_TIME_LIMIT, auto_next_question)
-            question_timer.daemon = True
-            question_timer.start()
+            question_timer = clock.call_later(ANSWER_TIME_LIMIT, auto_next_question)
         else:
             end_game()
 
@@ -314,7 +784,7 @@ def auto_next_question():
         'message': 'Time is up! Moving to next question...'
     })
     
-    time.sleep(2)
+    clock.sleep(TRANSITION_DELAY)
     send_next_question()
 
 
@@ -349,10 +819,18 @@ def handle_answer(client_socket, submitted_answer):
     
     # Get correct answer for current question
     if question_idx >= 0 and question_idx < len(questions):
-        correct_answer = questions[question_idx]['answer']
+        question_data = questions[question_idx]
+        correct_answer = question_data['answer']
+        
+        session = profiler
+        if session is not None:
+            started = time.perf_counter()
         
         # Compare answers (case-insensitive, strip whitespace)
-        is_correct = submitted_answer.strip().lower() == correct_answer.strip().lower()
+        is_correct = normalize_text(submitted_answer) == normalize_text(correct_answer)
+        
+        if session is not None:
+            session.record('match', time.perf_counter() - started)
         
         # Update score and mark as answered
         with players_lock:
@@ -385,7 +863,7 @@ def handle_answer(client_socket, submitted_answer):
                 question_timer = None
             
             print("✓ All players answered! Moving to next question...")
-            time.sleep(2)
+            clock.sleep(TRANSITION_DELAY)
             send_next_question()
 
 
@@ -457,246 +935,1294 @@ def check_start_game():
 
 
 # ============================================================================
-# CLIENT HANDLER
+# ADMIN
 # ============================================================================
 
-def handle_client(client_socket, address):
+def is_admin(message):
     """
-    Handle all communication with a single client
-    
-    CONCEPT: Client Thread
-    - Each client gets its own thread
-    - Continuously listens for messages
-    - Parses JSON and routes to appropriate handler
-    - Cleans up on disconnect
+    Check the admin token on a message
     
-    This is the heart of the server - it runs in a loop for each
-    connected client, waiting for messages and responding appropriately.
-    
-    Args:
-        client_socket: The socket for this client
-        address: Client's IP address and port
+    Admin messages are disabled entirely unless FLASHCARD_ADMIN_TOKEN is set.
     """
-    print(f"✓ New connection from {address}")
-    
-    player_name = None
-    buffer = ""  # Buffer for incomplete messages
+    token = message.get('admin_token')
+    if not ADMIN_TOKEN or not isinstance(token, str):
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+
+def run_import(client_socket, path):
+    """
+    Run an admin-requested deck import and report back to the admin
     
+    Runs in its own thread so the admin's connection (and every game)
+    stays responsive while a large deck streams in.
+    """
     try:
-        while True:
-            # Receive data from client
-            # CONCEPT: recv() blocks until data arrives
-            data = client_socket.recv(4096)
-            
-            if not data:
-                # Empty data means client disconnected
-                print(f"Client {address} disconnected")
-                break
-            
-            # Decode bytes to string and add to buffer
-            buffer += data.decode('utf-8')
-            
-            # Process complete messages (delimited by newlines)
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                
-                if not line.strip():
-                    continue
-                
-                try:
-                    # Parse JSON message
-                    message = json.loads(line)
-                    message_type = message.get('type')
-                    
-                    print(f"← Received from {address}: {message_type}")
-                    
-                    # ========================================
-                    # MESSAGE ROUTING
-                    # ========================================
-                    
-                    if message_type == 'JOIN':
-                        """
-                        Client wants to join the game
-                        
-                        Expected message:
-                        {"type": "JOIN", "player_name": "Alice"}
-                        """
-                        player_name = message.get('player_name', 'Anonymous')
-                        
-                        # Add player to game
-                        with players_lock:
-                            players.append({
-                                'name': player_name,
-                                'socket': client_socket,
-                                'score': 0,
-                                'ready': False,
-                                'answered': False
-                            })
-                        
-                        print(f"✓ {player_name} joined! Total players: {len(players)}")
-                        
-                        # Send confirmation to this player
-                        response = {
-                            'type': 'JOINED',
-                            'status': 'success',
-                            'message': f'Welcome {player_name}!',
-                            'players_count': len(players),
-                            'min_players': MIN_PLAYERS
-                        }
-                        send_message(client_socket, response)
-                        
-                        # Notify all other players
-                        broadcast({
-                            'type': 'PLAYER_JOINED',
-                            'player_name': player_name,
-                            'players_count': len(players)
-                        }, exclude_socket=client_socket)
-                    
-                    elif message_type == 'READY':
-                        """
-                        Player is ready to start
-                        
-                        Expected message:
-                        {"type": "READY"}
-                        """
-                        player = get_player_by_socket(client_socket)
-                        if player:
-                            with players_lock:
-                                player['ready'] = True
-                            print(f"✓ {player['name']} is ready")
-                            
-                            # Notify all players
-                            broadcast({
-                                'type': 'PLAYER_READY',
-                                'player_name': player['name']
-                            })
-                            
-                            # Check if we can start game
-                            if check_start_game():
-                                print("🎮 Starting game...")
-                                initialize_game()
-                                
-                                # Notify all players game is starting
-                                broadcast({
-                                    'type': 'GAME_STARTING',
-                                    'message': 'Get ready! Game starting...'
-                                })
-                                
-                                # Wait a moment then send first question
-                                time.sleep(2)
-                                send_next_question()
-                    
-                    elif message_type == 'ANSWER':
-                        """
-                        Player submitted an answer
-                        
-                        Expected message:
-                        {"type": "ANSWER", "answer": "12"}
-                        """
-                        with game_lock:
-                            if not game_started:
-                                send_message(client_socket, {
-                                    'type': 'ERROR',
-                                    'message': 'Game has not started yet'
-                                })
-                                continue
-                        
-                        answer = message.get('answer', '')
-                        handle_answer(client_socket, answer)
-                    
-                    elif message_type == 'NEXT':
-                        """
-                        Request next question (usually from host)
-                        
-                        Expected message:
-                        {"type": "NEXT"}
-                        """
-                        with game_lock:
-                            if game_started:
-                                send_next_question()
-                    
-                    elif message_type == 'PING':
-                        """
-                        Heartbeat to check connection
-                        
-                        Expected message:
-                        {"type": "PING"}
-                        """
-                        send_message(client_socket, {'type': 'PONG'})
-                    
-                    else:
-                        # Unknown message type
-                        print(f"⚠ Unknown message type: {message_type}")
-                        send_message(client_socket, {
-                            'type': 'ERROR',
-                            'message': f'Unknown message type: {message_type}'
-                        })
-                
-                except json.JSONDecodeError as e:
-                    print(f"⚠ Invalid JSON from {address}: {e}")
-                    send_message(client_socket, {
-                        'type': 'ERROR',
-                        'message': 'Invalid JSON format'
-                    })
-    
-    except Exception as e:
-        print(f"⚠ Error handling client {address}: {e}")
+        stats = import_deck(path)
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"⚠ Import of {path} failed: {e}")
+        send_message(client_socket, {
+            'type': 'ERROR',
+            'message': f'Import failed: {e}'
+        })
+        return
     
-    finally:
-        # Clean up when client disconnects
-        print(f"✗ Cleaning up connection from {address}")
-        remove_player(client_socket)
-        try:
-            client_socket.close()
-        except:
-            pass
+    response = {'type': 'IMPORT_COMPLETE'}
+    response.update(stats)
+    response['total_flashcards'] = len(FLASHCARD_POOL)
+    response['categories'] = category_counts()
+    send_message(client_socket, response)
 
 
 # ============================================================================
-# MAIN SERVER
+# PROFILING
 # ============================================================================
 
-def start_server():
+PROFILE_MODES = ('spans', 'cprofile', 'stack')
+PROFILED_MESSAGE_TYPES = ('JOIN', 'READY', 'ANSWER', 'NEXT')
+
+# The active ProfilingSession, or None. Instrumented code copies this into a
+# local and checks it once, so profiling costs nothing measurable when off.
+profiler = None
+profiler_lock = threading.Lock()
+
+
+class TimedLock:
     """
-    Start the TCP server
+    Stand-in for players_lock/game_lock while profiling is on
     
-    CONCEPT: Server Main Loop
-    1. Create a TCP socket
-    2. Bind to address and port
-    3. Listen for connections
-    4. Accept clients in infinite loop
-    5. Spawn thread for each client
+    Wraps the real lock and records how long each acquire waited. It is
+    swapped in only for the profiling window, so the normal path never
+    pays for the timing.
+    """
     
-    This function runs forever, accepting new clients and
-    creating a thread for each one.
+    def __init__(self, lock, span_name, session):
+        self.lock = lock
+        self.span_name = span_name
+        self.session = session
+    
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.session.record(self.span_name, time.perf_counter() - started)
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class ProfilingSession:
     """
-    # Create TCP socket
-    # CONCEPT: AF_INET = IPv4, SOCK_STREAM = TCP
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    One profiling window, started by the PROFILE admin message
     
-    # Allow reusing address immediately after server restart
-    # CONCEPT: SO_REUSEADDR prevents "Address already in use" error
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    CONCEPT: Timing Spans
+    - Every mode records spans: JSON parsing, each message handler,
+      lock waits, answer matching and broadcast fan-out
+    - 'cprofile' also runs every Nth message under cProfile
+    - 'stack' also samples the stacks of threads inside a handler
+    """
     
-    try:
-        # Bind socket to address and port
-        # CONCEPT: This claims the port for our server
-        server_socket.bind((HOST, PORT))
+    def __init__(self, mode, duration, sample_every, interval):
+        self.mode = mode
+        self.duration = duration
+        self.sample_every = sample_every
+        self.interval = interval
+        self.messages = 0
+        self.spans = {}  # {name: [count, total seconds, max seconds]}
+        self.spans_lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stopped = threading.Event()
         
-        # Listen for connections (queue up to 5 pending connections)
-        # CONCEPT: Server is now ready to accept clients
-        server_socket.listen(5)
+        self.cprofiler = cProfile.Profile() if mode == 'cprofile' else None
+        self.cprofile_lock = threading.Lock()  # One Profile can't span threads
+        self.cprofile_samples = 0
+        
+        self.stacks = collections.Counter()
+        self.stack_samples = 0
+        self.sampler_thread = None
+    
+    def record(self, name, elapsed):
+        """Add one timing to a span"""
+        with self.spans_lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [1, elapsed, elapsed]
+            else:
+                span[0] += 1
+                span[1] += elapsed
+                if elapsed > span[2]:
+                    span[2] = elapsed
+    
+    def dispatch(self, client_socket, address, message):
+        """Run handle_message() inside a timing span (and maybe cProfile)"""
+        message_type = message.get('type')
+        if message_type not in PROFILED_MESSAGE_TYPES:
+            message_type = 'OTHER'
+        
+        with self.spans_lock:
+            self.messages += 1
+            sampled = self.cprofiler is not None and self.messages % self.sample_every == 0
+        
+        started = time.perf_counter()
+        
+        if sampled and self.cprofile_lock.acquire(blocking=False):
+            try:
+                self.cprofile_samples += 1
+                self.cprofiler.runcall(handle_message, client_socket, address, message)
+            finally:
+                self.cprofile_lock.release()
+        else:
+            handle_message(client_socket, address, message)
+        
+        self.record(f'handler:{message_type}', time.perf_counter() - started)
+    
+    def sample_stacks(self):
+        """
+        Stack sampler loop (runs in its own thread in 'stack' mode)
+        
+        Only threads currently inside a message handler or question timer
+        are counted. Each stack is stored root-first as "a;b;c", the
+        collapsed format flame graph tools read.
+        """
+        handler_codes = {handle_message.__code__, auto_next_question.__code__}
+        sampler_id = threading.get_ident()
+        
+        while not self.stopped.wait(self.interval):
+            self.stack_samples += 1
+            
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                
+                stack = []
+                while frame is not None and len(stack) < 50:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name}:{frame.f_lineno}")
+                    if code in handler_codes:
+                        self.stacks[';'.join(reversed(stack))] += 1
+                        break
+                    frame = frame.f_back
+    
+    def report(self):
+        """
+        Build the PROFILE_REPORT message
+        
+        Returns:
+            Dictionary with span statistics and a text report
+        """
+        elapsed = time.perf_counter() - self.started
+        
+        with self.spans_lock:
+            spans = [
+                {
+                    'name': name,
+                    'count': count,
+                    'total_ms': round(total * 1000, 3),
+                    'avg_ms': round(total * 1000 / count, 3),
+                    'max_ms': round(longest * 1000, 3)
+                }
+                for name, (count, total, longest) in self.spans.items()
+            ]
+        spans.sort(key=lambda span: span['total_ms'], reverse=True)
+        
+        lines = [f"{'span':<20} {'count':>8} {'total ms':>12} {'avg ms':>10} {'max ms':>10}"]
+        for span in spans:
+            lines.append(f"{span['name']:<20} {span['count']:>8} {span['total_ms']:>12.3f} "
+                         f"{span['avg_ms']:>10.3f} {span['max_ms']:>10.3f}")
+        
+        if self.cprofiler is not None:
+            lines.append('')
+            lines.append(f"cProfile: {self.cprofile_samples} of {self.messages} messages sampled")
+            if self.cprofile_samples:
+                stats_text = io.StringIO()
+                stats = pstats.Stats(self.cprofiler, stream=stats_text)
+                stats.sort_stats('cumulative').print_stats(25)
+                lines.append(stats_text.getvalue().rstrip())
+        
+        if self.mode == 'stack':
+            lines.append('')
+            lines.append(f"Stack samples: {self.stack_samples} taken every {self.interval * 1000:g} ms")
+            for stack, count in self.stacks.most_common(20):
+                lines.append(f"{count:>6}  {stack}")
+        
+        return {
+            'type': 'PROFILE_REPORT',
+            'mode': self.mode,
+            'duration': round(elapsed, 3),
+            'messages': self.messages,
+            'spans': spans,
+            'report': '\n'.join(lines)
+        }
+
+
+def start_profiling(client_socket, mode, duration, sample_every, interval):
+    """
+    Start a profiling window that reports back to client_socket when done
+    
+    CONCEPT: Swap-In Instrumentation
+    - The session becomes the global 'profiler', which the instrumented
+      code checks before timing anything
+    - players_lock and game_lock are replaced with TimedLock wrappers
+      around the same locks, so lock waits are measured too
+    - A timer ends the window and restores everything
+    
+    Raises:
+        ValueError: If a profiling window is already running
+    """
+    global profiler, players_lock, game_lock
+    
+    with profiler_lock:
+        if profiler is not None:
+            raise ValueError('Profiling is already running')
+        
+        session = ProfilingSession(mode, duration, sample_every, interval)
+        players_lock = TimedLock(players_lock, 'lock_wait:players', session)
+        game_lock = TimedLock(game_lock, 'lock_wait:game', session)
+        profiler = session
+    
+    if mode == 'stack':
+        session.sampler_thread = threading.Thread(target=session.sample_stacks, daemon=True)
+        session.sampler_thread.start()
+    
+    # Profiling always runs on wall-clock time, even if the game clock is virtual
+    stop_timer = threading.Timer(duration, stop_profiling, args=(session, client_socket))
+    stop_timer.daemon = True
+    stop_timer.start()
+    
+    print(f"🔬 Profiling started ({mode}, {duration:g}s)")
+
+
+def stop_profiling(session, client_socket):
+    """End a profiling window, restore the real locks and send the report"""
+    global profiler, players_lock, game_lock
+    
+    with profiler_lock:
+        profiler = None
+        players_lock = players_lock.lock
+        game_lock = game_lock.lock
+    
+    session.stopped.set()
+    if session.sampler_thread is not None:
+        session.sampler_thread.join()
+    
+    report = session.report()
+    print(f"🔬 Profiling finished ({report['messages']} messages)")
+    print(report['report'])
+    send_message(client_socket, report)
+
+
+# ============================================================================
+# CLIENT HANDLER
+# ============================================================================
+
+def handle_message(client_socket, address, message):
+    """
+    Route one parsed message to the right handler
+    
+    CONCEPT: Transport-Independent Dispatch
+    - Both the TCP and WebSocket listeners end up here
+    - Game logic never needs to know which transport a client uses
+    
+    Args:
+        client_socket: The client's socket (or WebSocketClient)
+        address: Client's IP address and port
+        message: Parsed JSON message dictionary
+    """
+    message_type = message.get('type')
+    
+    print(f"← Received from {address}: {message_type}")
+    
+    # ========================================
+    # MESSAGE ROUTING
+    # ========================================
+    
+    if message_type == 'JOIN':
+        """
+        Client wants to join the game
+        
+        Expected message:
+        {"type": "JOIN", "player_name": "Alice"}
+        """
+        player_name = message.get('player_name', 'Anonymous')
+        
+        # Add player to game
+        with players_lock:
+            players.append({
+                'name': player_name,
+                'socket': client_socket,
+                'score': 0,
+                'ready': False,
+                'answered': False
+            })
+        
+        print(f"✓ {player_name} joined! Total players: {len(players)}")
+        
+        # Send confirmation to this player
+        response = {
+            'type': 'JOINED',
+            'status': 'success',
+            'message': f'Welcome {player_name}!',
+            'players_count': len(players),
+            'min_players': MIN_PLAYERS
+        }
+        send_message(client_socket, response)
+        
+        # Notify all other players
+        broadcast({
+            'type': 'PLAYER_JOINED',
+            'player_name': player_name,
+            'players_count': len(players)
+        }, exclude_socket=client_socket)
+    
+    elif message_type == 'READY':
+        """
+        Player is ready to start
+        
+        Expected message:
+        {"type": "READY"}
+        """
+        player = get_player_by_socket(client_socket)
+        if player:
+            with players_lock:
+                player['ready'] = True
+            print(f"✓ {player['name']} is ready")
+            
+            # Notify all players
+            broadcast({
+                'type': 'PLAYER_READY',
+                'player_name': player['name']
+            })
+            
+            # Check if we can start game
+            if check_start_game():
+                print("🎮 Starting game...")
+                initialize_game()
+                
+                # Notify all players game is starting
+                broadcast({
+                    'type': 'GAME_STARTING',
+                    'message': 'Get ready! Game starting...'
+                })
+                
+                # Wait a moment then send first question
+                clock.sleep(TRANSITION_DELAY)
+                send_next_question()
+    
+    elif message_type == 'ANSWER':
+        """
+        Player submitted an answer
+        
+        Expected message:
+        {"type": "ANSWER", "answer": "12"}
+        """
+        with game_lock:
+            if not game_started:
+                send_message(client_socket, {
+                    'type': 'ERROR',
+                    'message': 'Game has not started yet'
+                })
+                return
+        
+        answer = message.get('answer', '')
+        handle_answer(client_socket, answer)
+    
+    elif message_type == 'NEXT':
+        """
+        Request next question (usually from host)
+        
+        Expected message:
+        {"type": "NEXT"}
+        """
+        with game_lock:
+            if game_started:
+                send_next_question()
+    
+    elif message_type == 'PING':
+        """
+        Heartbeat to check connection
+        
+        Expected message:
+        {"type": "PING"}
+        """
+        send_message(client_socket, {'type': 'PONG'})
+    
+    elif message_type == 'IMPORT':
+        """
+        Admin: stream a CSV/JSONL deck into the pool
+        
+        Expected message:
+        {"type": "IMPORT", "admin_token": "secret", "path": "decks/world.csv"}
+        """
+        if not is_admin(message):
+            send_message(client_socket, {
+                'type': 'ERROR',
+                'message': 'Admin access denied'
+            })
+            return
+        
+        path = message.get('path')
+        if not isinstance(path, str) or not path:
+            send_message(client_socket, {
+                'type': 'ERROR',
+                'message': 'IMPORT requires a deck path'
+            })
+            return
+        
+        send_message(client_socket, {
+            'type': 'IMPORT_STARTED',
+            'path': path
+        })
+        
+        import_thread = threading.Thread(
+            target=run_import,
+            args=(client_socket, path),
+            daemon=True
+        )
+        import_thread.start()
+    
+    elif message_type == 'PROFILE':
+        """
+        Admin: profile message handling for a time window
+        
+        Expected message:
+        {"type": "PROFILE", "admin_token": "secret", "duration": 10,
+         "mode": "spans" | "cprofile" | "stack",
+         "sample_every": 10, "interval": 0.005}
+        """
+        if not is_admin(message):
+            send_message(client_socket, {
+                'type': 'ERROR',
+                'message': 'Admin access denied'
+            })
+            return
+        
+        mode = message.get('mode', 'spans')
+        duration = message.get('duration', 10)
+        sample_every = message.get('sample_every', PROFILE_DEFAULT_SAMPLE_EVERY)
+        interval = message.get('interval', PROFILE_DEFAULT_INTERVAL)
+        
+        # bool is an int subclass and json.loads accepts Infinity/NaN, so
+        # check types strictly and bound every number on both sides
+        numbers_valid = all(
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+            for value in (duration, sample_every, interval)
+        )
+        if (mode not in PROFILE_MODES
+                or not numbers_valid
+                or not 0 < duration <= PROFILE_MAX_DURATION
+                or not isinstance(sample_every, int) or sample_every < 1
+                or not 0.001 <= interval <= duration):
+            send_message(client_socket, {
+                'type': 'ERROR',
+                'message': f'PROFILE needs mode in {PROFILE_MODES}, '
+                           f'0 < duration <= {PROFILE_MAX_DURATION}, '
+                           f'sample_every >= 1 and 0.001 <= interval <= duration'
+            })
+            return
+        
+        try:
+            start_profiling(client_socket, mode, duration, sample_every, interval)
+        except ValueError as e:
+            send_message(client_socket, {
+                'type': 'ERROR',
+                'message': str(e)
+            })
+            return
+        
+        send_message(client_socket, {
+            'type': 'PROFILE_STARTED',
+            'mode': mode,
+            'duration': duration
+        })
+    
+    else:
+        # Unknown message type
+        print(f"⚠ Unknown message type: {message_type}")
+        send_message(client_socket, {
+            'type': 'ERROR',
+            'message': f'Unknown message type: {message_type}'
+        })
+
+
+def handle_line(client_socket, address, line):
+    """
+    Parse one JSON message from a client and dispatch it
+    
+    Args:
+        client_socket: The client's socket (or WebSocketClient)
+        address: Client's IP address and port
+        line: Raw JSON text (one TCP line or one WebSocket text message)
+    """
+    if not line.strip():
+        return
+    
+    # Profiling off = one None check per message
+    session = profiler
+    if session is not None:
+        started = time.perf_counter()
+    
+    try:
+        message = json.loads(line)
+    except json.JSONDecodeError as e:
+        print(f"⚠ Invalid JSON from {address}: {e}")
+        send_message(client_socket, {
+            'type': 'ERROR',
+            'message': 'Invalid JSON format'
+        })
+        return
+    
+    if not isinstance(message, dict):
+        send_message(client_socket, {
+            'type': 'ERROR',
+            'message': 'Message must be a JSON object'
+        })
+        return
+    
+    if session is None:
+        handle_message(client_socket, address, message)
+    else:
+        session.record('parse', time.perf_counter() - started)
+        session.dispatch(client_socket, address, message)
+
+
+def handle_client(client_socket, address):
+    """
+    Handle all communication with a single client
+    
+    CONCEPT: Client Thread
+    - Each client gets its own thread
+    - Continuously listens for messages
+    - Parses JSON and routes to appropriate handler
+    - Cleans up on disconnect
+    
+    This is the heart of the server - it runs in a loop for each
+    connected client, waiting for messages and responding appropriately.
+    
+    Args:
+        client_socket: The socket for this client
+        address: Client's IP address and port
+    """
+    print(f"✓ New connection from {address}")
+    
+    buffer = ""  # Buffer for incomplete messages
+    
+    try:
+        while True:
+            # Receive data from client
+            # CONCEPT: recv() blocks until data arrives
+            data = client_socket.recv(4096)
+            
+            if not data:
+                # Empty data means client disconnected
+                print(f"Client {address} disconnected")
+                break
+            
+            # Decode bytes to string and add to buffer
+            buffer += data.decode('utf-8')
+            
+            # Process complete messages (delimited by newlines)
+            while '\n' in buffer:
+                line, buffer = buffer.split('\n', 1)
+                handle_line(client_socket, address, line)
+    
+    except Exception as e:
+        print(f"⚠ Error handling client {address}: {e}")
+    
+    finally:
+        # Clean up when client disconnects
+        print(f"✗ Cleaning up connection from {address}")
+        remove_player(client_socket)
+        try:
+            client_socket.close()
+        except:
+            pass
+
+
+# ============================================================================
+# WEBSOCKET GATEWAY
+# ============================================================================
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WEBSOCKET_BAD_REQUEST = (b'HTTP/1.1 400 Bad Request\r\n'
+                         b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+
+
+class WebSocketError(Exception):
+    """A WebSocket protocol violation, with the close code to send back"""
+    
+    def __init__(self, close_code, reason):
+        super().__init__(reason)
+        self.close_code = close_code
+
+
+class WebSocketClient:
+    """
+    A connected WebSocket client
+    
+    Stored in a player's 'socket' field just like a TCP socket, so all of
+    the game logic works with it unchanged. send_message() spots this class
+    and sends a WebSocket frame instead of a newline-delimited line.
+    """
+    
+    def __init__(self, sock, deflate):
+        self.sock = sock
+        self.deflate = deflate  # permessage-deflate was negotiated
+        self.send_lock = threading.Lock()  # Frames must never interleave
+    
+    def send_frame(self, frame):
+        """Send one complete, pre-built frame"""
+        with self.send_lock:
+            self.sock.sendall(frame)
+    
+    def close(self):
+        self.sock.close()
+
+
+def negotiate_deflate(extensions_header):
+    """
+    Choose a permessage-deflate offer we can accept
+    
+    Offers that limit the server's window below 15 bits are declined,
+    because the shared broadcast frames are always compressed with the
+    full 15-bit window. server_max_window_bits=15 is accepted and echoed.
+    
+    Args:
+        extensions_header: The client's Sec-WebSocket-Extensions value
+    
+    Returns:
+        Sec-WebSocket-Extensions response value, or None for no compression
+    """
+    if not WEBSOCKET_COMPRESSION or not extensions_header:
+        return None
+    
+    for offer in extensions_header.split(','):
+        params = [param.strip() for param in offer.split(';')]
+        if params[0].lower() != 'permessage-deflate':
+            continue
+        
+        values = {}
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            values[name.strip().lower()] = value.strip().strip('"')
+        
+        response = 'permessage-deflate; server_no_context_takeover'
+        if 'server_max_window_bits' in values:
+            if values['server_max_window_bits'] != '15':
+                continue
+            response += '; server_max_window_bits=15'
+        
+        return response
+    
+    return None
+
+
+def websocket_handshake(sock, rfile):
+    """
+    Perform the HTTP Upgrade handshake (RFC 6455 section 4.2)
+    
+    Args:
+        sock: The accepted TCP socket
+        rfile: Buffered reader over the same socket
+    
+    Returns:
+        WebSocketClient on success, None if the request was rejected
+    """
+    request_line = rfile.readline(8192).decode('latin-1')
+    
+    headers = {}
+    while True:
+        line = rfile.readline(8192)
+        if not line or line in (b'\r\n', b'\n'):
+            break
+        if len(headers) >= 100:
+            sock.sendall(WEBSOCKET_BAD_REQUEST)
+            return None
+        
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            value = headers[name] + ', ' + value
+        headers[name] = value
+    
+    key = headers.get('sec-websocket-key')
+    if (not request_line.startswith('GET ')
+            or 'websocket' not in headers.get('upgrade', '').lower()
+            or not key):
+        sock.sendall(WEBSOCKET_BAD_REQUEST)
+        return None
+    
+    if headers.get('sec-websocket-version') != '13':
+        sock.sendall(b'HTTP/1.1 426 Upgrade Required\r\n'
+                     b'Sec-WebSocket-Version: 13\r\n'
+                     b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+        return None
+    
+    accept = base64.b64encode(
+        hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()
+    ).decode('ascii')
+    extensions = negotiate_deflate(headers.get('sec-websocket-extensions'))
+    
+    response = [
+        'HTTP/1.1 101 Switching Protocols',
+        'Upgrade: websocket',
+        'Connection: Upgrade',
+        f'Sec-WebSocket-Accept: {accept}'
+    ]
+    if extensions:
+        response.append(f'Sec-WebSocket-Extensions: {extensions}')
+    sock.sendall(('\r\n'.join(response) + '\r\n\r\n').encode('ascii'))
+    
+    return WebSocketClient(sock, deflate=extensions is not None)
+
+
+def read_exact(rfile, size):
+    """Read exactly size bytes or raise ConnectionError"""
+    data = rfile.read(size)
+    if len(data) < size:
+        raise ConnectionError('Connection closed mid-frame')
+    return data
+
+
+def unmask(payload, mask):
+    """Undo the client's XOR masking (done as one big-integer XOR for speed)"""
+    if not payload:
+        return payload
+    
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+def read_websocket_frame(rfile):
+    """
+    Read one frame from a client
+    
+    Returns:
+        (fin, rsv1, opcode, payload) tuple, or None if the client hung up
+    
+    Raises:
+        WebSocketError: If the frame breaks the protocol or is too big
+    """
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None
+    
+    first_byte, second_byte = header
+    fin = bool(first_byte & 0x80)
+    rsv1 = bool(first_byte & 0x40)
+    opcode = first_byte & 0x0F
+    
+    if first_byte & 0x30:
+        raise WebSocketError(1002, 'Unsupported RSV bits')
+    if not second_byte & 0x80:
+        raise WebSocketError(1002, 'Client frames must be masked')
+    
+    length = second_byte & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', read_exact(rfile, 8))[0]
+    
+    if length > WEBSOCKET_MAX_MESSAGE_SIZE:
+        raise WebSocketError(1009, 'Message too big')
+    
+    mask = read_exact(rfile, 4)
+    payload = unmask(read_exact(rfile, length), mask)
+    return fin, rsv1, opcode, payload
+
+
+def handle_websocket_client(client_socket, address):
+    """
+    Handle all communication with a single WebSocket client
+    
+    CONCEPT: One Engine, Two Transports
+    - After the handshake, each complete text message is passed to
+      handle_line(), exactly like one line from a TCP client
+    - Pings, fragmentation and compression are dealt with here, so
+      the game logic never sees them
+    
+    Args:
+        client_socket: The accepted TCP socket
+        address: Client's IP address and port
+    """
+    print(f"✓ New WebSocket connection from {address}")
+    
+    rfile = client_socket.makefile('rb')
+    client = None
+    
+    try:
+        client = websocket_handshake(client_socket, rfile)
+        if client is None:
+            print(f"⚠ Rejected WebSocket handshake from {address}")
+            return
+        
+        decompressor = zlib.decompressobj(-15)
+        message_parts = None  # Fragments of the message being received
+        message_size = 0
+        compressed = False
+        
+        while True:
+            frame = read_websocket_frame(rfile)
+            if frame is None:
+                print(f"Client {address} disconnected")
+                break
+            
+            fin, rsv1, opcode, payload = frame
+            
+            # Control frames (may arrive between fragments)
+            if opcode >= 0x8:
+                if not fin or len(payload) > 125 or rsv1:
+                    raise WebSocketError(1002, 'Invalid control frame')
+                if opcode == 0x8:
+                    client.send_frame(build_websocket_frame(payload[:2], opcode=0x8))
+                    print(f"Client {address} closed the WebSocket")
+                    break
+                if opcode == 0x9:
+                    client.send_frame(build_websocket_frame(payload, opcode=0xA))
+                continue
+            
+            if opcode == 0x0:
+                if message_parts is None or rsv1:
+                    raise WebSocketError(1002, 'Unexpected continuation frame')
+            elif opcode == 0x1:
+                if message_parts is not None:
+                    raise WebSocketError(1002, 'Expected continuation frame')
+                if rsv1 and not client.deflate:
+                    raise WebSocketError(1002, 'Compression was not negotiated')
+                message_parts = []
+                message_size = 0
+                compressed = rsv1
+            else:
+                raise WebSocketError(1003, 'Only text messages are supported')
+            
+            message_size += len(payload)
+            if message_size > WEBSOCKET_MAX_MESSAGE_SIZE:
+                raise WebSocketError(1009, 'Message too big')
+            message_parts.append(payload)
+            
+            if not fin:
+                continue
+            
+            data = b''.join(message_parts)
+            message_parts = None
+            
+            if compressed:
+                data = decompressor.decompress(data + b'\x00\x00\xff\xff',
+                                               WEBSOCKET_MAX_MESSAGE_SIZE)
+                if decompressor.unconsumed_tail:
+                    raise WebSocketError(1009, 'Message too big')
+            
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError:
+                raise WebSocketError(1007, 'Text message is not valid UTF-8')
+            
+            handle_line(client, address, text)
+    
+    except WebSocketError as e:
+        print(f"⚠ WebSocket protocol error from {address}: {e}")
+        try:
+            close_payload = struct.pack('!H', e.close_code) + str(e).encode('utf-8')
+            client.send_frame(build_websocket_frame(close_payload, opcode=0x8))
+        except Exception:
+            pass
+    
+    except Exception as e:
+        print(f"⚠ Error handling WebSocket client {address}: {e}")
+    
+    finally:
+        print(f"✗ Cleaning up WebSocket connection from {address}")
+        if client:
+            remove_player(client)
+        try:
+            rfile.close()
+            client_socket.close()
+        except:
+            pass
+
+
+def accept_websocket_clients(server_socket):
+    """
+    Accept loop for the WebSocket listener (runs in a daemon thread)
+    
+    Args:
+        server_socket: The listening WebSocket socket
+    """
+    while True:
+        try:
+            client_socket, address = server_socket.accept()
+        except OSError:
+            # Listener was closed during shutdown
+            break
+        
+        client_thread = threading.Thread(
+            target=handle_websocket_client,
+            args=(client_socket, address),
+            daemon=True
+        )
+        client_thread.start()
+
+
+def start_websocket_listener():
+    """
+    Open the WebSocket port and start accepting clients in the background
+    
+    Returns:
+        The listening socket, so start_server() can close it on shutdown
+    """
+    websocket_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    websocket_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    websocket_socket.bind((HOST, WEBSOCKET_PORT))
+    websocket_socket.listen(5)
+    
+    accept_thread = threading.Thread(
+        target=accept_websocket_clients,
+        args=(websocket_socket,),
+        daemon=True
+    )
+    accept_thread.start()
+    
+    return websocket_socket
+
+
+# ============================================================================
+# SIMULATION
+# ============================================================================
+
+class SimulatedClient:
+    """
+    Stand-in for a client socket during a simulation
+    
+    Behaves like a TCP socket to the engine; every line sent to it is
+    recorded in the shared transcript with the virtual time it was sent.
+    """
+    
+    __slots__ = ('name', 'transcript')
+    
+    def __init__(self, name, transcript):
+        self.name = name
+        self.transcript = transcript
+    
+    def sendall(self, data):
+        self.transcript.append((clock.now(), self.name, data))
+    
+    def close(self):
+        pass
+
+
+def reset_game_state():
+    """Drop all players and any game in progress (used around simulations)"""
+    global players, game_started, current_question_index, questions, question_timer
+    
+    with game_lock:
+        if question_timer:
+            question_timer.cancel()
+        question_timer = None
+        game_started = False
+        current_question_index = 0
+        questions = []
+    
+    with players_lock:
+        players = []
+
+
+def parse_simulation_events(script):
+    """
+    Validate an event script and put its events in replay order
+    
+    A script is a JSON object like:
+        {"seed": 42, "expected_digest": "9f86d0...", "events": [
+            {"at": 0, "client": "alice", "message": {"type": "JOIN", "player_name": "Alice"}},
+            {"at": 1, "client": "alice", "message": {"type": "READY"}},
+            {"at": 90, "client": "alice", "disconnect": true}
+        ]}
+    
+    Events are ordered by time ('at', in virtual seconds), then by their
+    position in the script. 'seed' (an integer) and 'expected_digest' are
+    optional.
+    
+    Returns:
+        List of (at, client name, JSON line or None for a disconnect)
+    
+    Raises:
+        ValueError: If the script is malformed
+    """
+    events = script.get('events') if isinstance(script, dict) else None
+    if not isinstance(events, list):
+        raise ValueError("Simulation script needs an 'events' list")
+    
+    seed = script.get('seed', 0)
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        raise ValueError("'seed' must be an integer")
+    
+    if not isinstance(script.get('expected_digest', ''), str):
+        raise ValueError("'expected_digest' must be a string")
+    
+    parsed = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict) or not isinstance(event.get('client'), str):
+            raise ValueError(f"Event {index}: missing 'client' name")
+        
+        at = event.get('at', 0)
+        if not isinstance(at, (int, float)) or isinstance(at, bool) or at < 0:
+            raise ValueError(f"Event {index}: 'at' must be a non-negative number")
+        
+        if event.get('disconnect'):
+            line = None
+        elif isinstance(event.get('message'), dict):
+            line = json.dumps(event['message'])
+        else:
+            raise ValueError(f"Event {index}: needs a 'message' object or 'disconnect': true")
+        
+        parsed.append((at, index, event['client'], line))
+    
+    parsed.sort()
+    return [(at, client_name, line) for at, _, client_name, line in parsed]
+
+
+def run_simulation(script, seed=None):
+    """
+    Replay an event script against the game engine on a virtual clock
+    
+    CONCEPT: Deterministic Simulation
+    - Messages go through handle_line(), the same path as live clients
+    - Timers and sleeps use a VirtualClock, so a full game takes
+      microseconds instead of minutes
+    - Questions are picked by a random.Random seeded from the script
+    - Same script + same seed = same transcript, byte for byte
+    
+    Swaps the module's clock and rng for the duration, so it must not be
+    run while the server is serving real players.
+    
+    Handlers pause with clock.sleep() (e.g. TRANSITION_DELAY), and virtual
+    sleeps are atomic. If a pause carries the clock past an event's 'at',
+    that event runs late, at the clock's current time. Late events are
+    returned so the caller can warn; scripts should leave room for pauses.
+    
+    Args:
+        script: Event script dictionary (see parse_simulation_events)
+        seed: Overrides the script's 'seed'
+    
+    Returns:
+        (transcript, late_events) tuple:
+        - transcript: list of (virtual time, client name, bytes sent)
+        - late_events: list of (scheduled at, actual time, client name)
+    
+    Raises:
+        ValueError: If the script is malformed
+    """
+    global clock, rng
+    
+    events = parse_simulation_events(script)
+    if seed is None:
+        seed = script.get('seed', 0)
+    
+    transcript = []
+    late_events = []
+    clients = {}
+    previous_clock, previous_rng = clock, rng
+    clock = VirtualClock()
+    rng = random.Random(seed)
+    reset_game_state()
+    
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for at, client_name, line in events:
+                if at < clock.now():
+                    late_events.append((at, clock.now(), client_name))
+                clock.run(until=at)
+                
+                client = clients.get(client_name)
+                if client is None:
+                    client = clients[client_name] = SimulatedClient(client_name, transcript)
+                
+                if line is None:
+                    # Disconnect - a later event with this name reconnects
+                    remove_player(client)
+                    del clients[client_name]
+                else:
+                    handle_line(client, client_name, line)
+            
+            # Let the remaining timers play the game out
+            clock.run()
+    finally:
+        reset_game_state()
+        clock, rng = previous_clock, previous_rng
+    
+    return transcript, late_events
+
+
+def check_question_timing(transcript):
+    """
+    Check the question timers in a simulated transcript
+    
+    Timing is checked against the engine's own QUESTION broadcasts, not
+    what each client happened to receive, so players who join or rejoin
+    mid-question are handled. Every TIME_UP must come exactly
+    ANSWER_TIME_LIMIT after the latest QUESTION broadcast, and no client
+    may get two TIME_UPs for the same question. A timer left running from
+    an earlier question breaks one of those rules.
+    
+    Args:
+        transcript: List of (virtual time, client name, bytes sent) tuples
+    
+    Returns:
+        List of problem descriptions (empty if the timing is correct)
+    """
+    problems = []
+    current_question = None  # (question number, broadcast at)
+    timed_out = set()  # {(client name, question number, broadcast at)}
+    
+    for at, client_name, data in transcript:
+        if data.startswith(b'{"type": "QUESTION"'):
+            current_question = (json.loads(data)['number'], at)
+        elif data.startswith(b'{"type": "TIME_UP"'):
+            if current_question is None:
+                problems.append(f"{at:.3f} {client_name}: TIME_UP before any question")
+                continue
+            
+            number, sent_at = current_question
+            key = (client_name, number, sent_at)
+            if key in timed_out:
+                problems.append(f"{at:.3f} {client_name}: second TIME_UP for question {number}")
+            elif abs(at - sent_at - ANSWER_TIME_LIMIT) > 1e-6:
+                problems.append(f"{at:.3f} {client_name}: question {number} timed out after "
+                                f"{at - sent_at:g}s (limit {ANSWER_TIME_LIMIT}s)")
+            timed_out.add(key)
+    
+    return problems
+
+
+def run_simulation_command(path, seed=None, repeat=1, show_transcript=False):
+    """
+    Replay a script file one or more times and report the rate and digest
+    
+    Each repeat uses the next seed (seed, seed + 1, ...). The SHA-256
+    digest covers every transcript, so comparing it against a known value
+    catches any change in game behaviour. When the script has an
+    'expected_digest' and is run once with its own seed, the digest must
+    match it. Every transcript is also run through check_question_timing().
+    
+    Args:
+        path: Path to a JSON event script
+        seed: Starting seed (defaults to the script's)
+        repeat: Number of games to simulate
+        show_transcript: Print the last transcript
+    
+    Returns:
+        True if every check passed
+    """
+    with open(path, encoding='utf-8') as script_file:
+        script = json.load(script_file)
+    
+    parse_simulation_events(script)  # Validate before using the seed
+    
+    expected_digest = None
+    if seed is None and repeat == 1:
+        expected_digest = script.get('expected_digest')
+    
+    if seed is None:
+        seed = script.get('seed', 0)
+    
+    digest = hashlib.sha256()
+    transcript = []
+    problems = []
+    late_events = []
+    start_time = time.perf_counter()
+    
+    for run_index in range(repeat):
+        transcript, late = run_simulation(script, seed=seed + run_index)
+        late_events.extend(late)
+        for at, client_name, data in transcript:
+            digest.update(f'{at:.6f} {client_name} '.encode('utf-8'))
+            digest.update(data)
+        
+        for problem in check_question_timing(transcript):
+            problems.append(f"seed {seed + run_index}: {problem}")
+    
+    elapsed = time.perf_counter() - start_time
+    
+    if show_transcript:
+        for at, client_name, data in transcript:
+            print(f"{at:9.3f}  {client_name:<12} {data.decode('utf-8').rstrip()}")
+    
+    rate = repeat / elapsed if elapsed > 0 else float(repeat)
+    print(f"✓ Simulated {repeat:,} game(s) in {elapsed:.3f}s ({rate:,.0f} games/s)")
+    print(f"Transcript digest: {digest.hexdigest()}")
+    
+    passed = True
+    if expected_digest:
+        if digest.hexdigest() == expected_digest:
+            print("✓ Digest matches the script's expected_digest")
+        else:
+            print(f"⚠ Digest does not match the script's expected_digest ({expected_digest})")
+            passed = False
+    
+    if late_events:
+        at, actual, client_name = late_events[0]
+        print(f"⚠ {len(late_events):,} event(s) ran late because a handler's pause was "
+              f"still running (first: {client_name} at {at:g}s ran at {actual:g}s)")
+    
+    if problems:
+        print(f"⚠ {len(problems):,} question timing problem(s):")
+        for problem in problems[:10]:
+            print(f"  {problem}")
+        passed = False
+    
+    return passed
+
+
+# ============================================================================
+# MAIN SERVER
+# ============================================================================
+
+def start_server():
+    """
+    Start the TCP server
+    
+    CONCEPT: Server Main Loop
+    1. Create a TCP socket
+    2. Bind to address and port
+    3. Listen for connections
+    4. Accept clients in infinite loop
+    5. Spawn thread for each client
+    
+    This function runs forever, accepting new clients and
+    creating a thread for each one.
+    """
+    # Create TCP socket
+    # CONCEPT: AF_INET = IPv4, SOCK_STREAM = TCP
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    
+    # Allow reusing address immediately after server restart
+    # CONCEPT: SO_REUSEADDR prevents "Address already in use" error
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    websocket_socket = None
+    
+    try:
+        # Bind socket to address and port
+        # CONCEPT: This claims the port for our server
+        server_socket.bind((HOST, PORT))
+        
+        # Listen for connections (queue up to 5 pending connections)
+        # CONCEPT: Server is now ready to accept clients
+        server_socket.listen(5)
+        
+        # Second listener for WebSocket clients, sharing the same game
+        websocket_socket = start_websocket_listener()
         
         print("=" * 60)
-        print("🎮 FLASHCARD QUIZ SERVER")
-        print("=" * 60)
-        print(f"Server listening on {HOST}:{PORT}")
-        print(f"Minimum players: {MIN_PLAYERS}")
-        print(f"Questions per game: {TOTAL_QUESTIONS}")
-        print(f"Answer time limit: {ANSWER_TIME_LIMIT} seconds")
-        print(f"Total flashcards available: {len(FLASHCARD_POOL)}")
-        print(f"Waiting for connections...")
-        print("=" * 60)
+        print("🎮 FLASHCARD QUIZ SERVER")
+        print("=" * 60)
+        print(f"Server listening on {HOST}:{PORT}")
+        print(f"WebSocket gateway on {HOST}:{WEBSOCKET_PORT}")
+        print(f"Minimum players: {MIN_PLAYERS}")
+        print(f"Questions per game: {TOTAL_QUESTIONS}")
+        print(f"Answer time limit: {ANSWER_TIME_LIMIT} seconds")
+        print(f"Total flashcards available: {len(FLASHCARD_POOL)}")
+        print(f"Waiting for connections...")
+        print("=" * 60)
         
         # Main accept loop
         # CONCEPT: This runs forever, accepting new clients
@@ -729,6 +2255,8 @@ def start_server():
         # Clean up
         print("Closing server socket...")
         server_socket.close()
+        if websocket_socket:
+            websocket_socket.close()
         print("✓ Server stopped")
 
 
@@ -744,4 +2272,46 @@ if __name__ == '__main__':
     - Only runs if this file is executed (not imported)
     - Keeps code organized
     """
-    start_server()
+    parser = argparse.ArgumentParser(description='Flashcard Quiz multiplayer server')
+    parser.add_argument(
+        '--import', dest='decks', action='append', default=[], metavar='DECK',
+        help='CSV or JSONL deck to load before serving (repeatable)'
+    )
+    parser.add_argument(
+        '--import-only', action='store_true',
+        help='import the decks, report, and exit without serving'
+    )
+    parser.add_argument(
+        '--simulate', metavar='SCRIPT',
+        help='replay a JSON event script on a virtual clock instead of serving'
+    )
+    parser.add_argument(
+        '--seed', type=int,
+        help='random seed for --simulate (defaults to the script\'s seed)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1, metavar='N',
+        help='simulate N games, using seeds seed..seed+N-1'
+    )
+    parser.add_argument(
+        '--transcript', action='store_true',
+        help='print the messages sent during the (last) simulated game'
+    )
+    args = parser.parse_args()
+    
+    for deck_path in args.decks:
+        try:
+            import_deck(deck_path)
+        except (OSError, ValueError, csv.Error) as e:
+            parser.exit(1, f"⚠ Import of {deck_path} failed: {e}\n")
+    
+    if args.simulate:
+        try:
+            passed = run_simulation_command(args.simulate, args.seed, max(args.repeat, 1),
+                                            args.transcript)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"⚠ Simulation failed: {e}\n")
+        if not passed:
+            parser.exit(1)
+    elif not args.import_only:
+        start_server()